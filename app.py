@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, g
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import os
@@ -7,7 +7,12 @@ from werkzeug.security import generate_password_hash, check_password_hash
 import logging
 from logging.handlers import RotatingFileHandler
 import traceback
+import uuid
+import hashlib
 from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from werkzeug.middleware.proxy_fix import ProxyFix
+from rate_limit import RateLimiter, LoadShedder
 
 # Initialize Flask app
 app = Flask(__name__, 
@@ -23,8 +28,25 @@ if database_url.startswith("postgres://"):
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Rate limiting. gunicorn.conf.py points this at a shared sqlite:/// file so all
+# workers use the same buckets; memory:// (for app.run) keeps them per process.
+app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED', '1') != '0'
+app.config['RATELIMIT_STORAGE_URL'] = os.environ.get('RATELIMIT_STORAGE_URL', 'memory://')
+
+# Load shedding: 503 for requests that waited longer than this at the proxy
+app.config['SHED_ENABLED'] = os.environ.get('SHED_ENABLED', '1') != '0'
+app.config['SHED_MAX_QUEUE_WAIT'] = float(os.environ.get('SHED_MAX_QUEUE_WAIT', 10))
+
+# Behind a reverse proxy remote_addr is the proxy itself, which would put every
+# visitor in one rate-limit bucket, so trust its X-Forwarded-For. Render sets
+# RENDER in the environment, so this is on there by default.
+if os.environ.get('TRUST_PROXY', '1' if os.environ.get('RENDER') else '0') == '1':
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
+
 # Initialize database
 db = SQLAlchemy(app)
+limiter = RateLimiter(app)
+shedder = LoadShedder(app)
 
 # Database Models
 class Service(db.Model):
@@ -45,6 +67,7 @@ class ServiceRequest(db.Model):
     address = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=True)
     urgency = db.Column(db.String(20), nullable=True)
+    idempotency_key = db.Column(db.String(100), unique=True, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __repr__(self):
@@ -101,9 +124,40 @@ def service_form(service_id):
         return redirect(url_for('login', next=next_url))
 
     service = Service.query.get_or_404(service_id)
-    return render_template('service_form.html', service=service)
+    return render_template('service_form.html', service=service, idempotency_key=uuid.uuid4().hex)
+
+REQUEST_FIELDS = ('service_id', 'customer_name', 'customer_email', 'customer_phone',
+                  'address', 'description', 'urgency')
+
+def _idempotency_key():
+    # Scope the client's key to the user so keys can't collide across accounts;
+    # hashing keeps keys of any length distinct and within the column size
+    key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    if key and session.get('user_id'):
+        return f"{session['user_id']}:{hashlib.sha256(key.encode('utf-8')).hexdigest()}"
+    return None
+
+def _find_idempotent_request(idempotency_key):
+    return ServiceRequest.query.filter_by(idempotency_key=idempotency_key).first()
+
+def _matches_submission(existing):
+    return all(str(getattr(existing, field) or '') == (request.form.get(field) or '')
+               for field in REQUEST_FIELDS)
+
+def _idempotent_response(existing):
+    if not _matches_submission(existing):
+        return 'This form was already submitted with different details. Please reload the form and submit again.', 422
+    return render_template('confirmation.html', request=existing)
+
+def _is_idempotent_replay():
+    # Only consulted once the submit bucket is empty: retries of an already
+    # stored request are still answered instead of getting a 429
+    idempotency_key = _idempotency_key()
+    g.idempotent_request = _find_idempotent_request(idempotency_key) if idempotency_key else None
+    return g.idempotent_request is not None
 
 @app.route('/submit_request', methods=['POST'])
+@limiter.limit('submit', 10, 60, key='user', exempt_when=_is_idempotent_replay)
 def submit_request():
     if request.method == 'POST':
         if not session.get('user_id'):
@@ -118,6 +172,15 @@ def submit_request():
         address = request.form.get('address')
         description = request.form.get('description')
         urgency = request.form.get('urgency')
+
+        idempotency_key = _idempotency_key()
+        if idempotency_key:
+            if 'idempotent_request' in g:
+                existing = g.idempotent_request
+            else:
+                existing = _find_idempotent_request(idempotency_key)
+            if existing:
+                return _idempotent_response(existing)
         
         new_request = ServiceRequest(
             service_id=service_id,
@@ -126,11 +189,21 @@ def submit_request():
             customer_phone=customer_phone,
             address=address,
             description=description,
-            urgency=urgency
+            urgency=urgency,
+            idempotency_key=idempotency_key
         )
         
         db.session.add(new_request)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            # A concurrent retry with the same key may have won the race;
+            # anything else (e.g. a missing required field) is a real error
+            existing = _find_idempotent_request(idempotency_key) if idempotency_key else None
+            if existing is None:
+                raise
+            return _idempotent_response(existing)
         
         return render_template('confirmation.html', request=new_request)
 
@@ -142,6 +215,7 @@ def get_services():
 
 # Authentication routes
 @app.route('/register', methods=['GET', 'POST'])
+@limiter.limit('register', 5, 3600)
 def register():
     if request.method == 'POST':
         try:
@@ -182,6 +256,7 @@ def register():
     return render_template('register.html', services=services)
 
 @app.route('/login', methods=['GET', 'POST'])
+@limiter.limit('login', 10, 300)
 def login():
     if request.method == 'POST':
         try:
@@ -357,6 +432,19 @@ def initialize_database():
                         print("Added 'service_type' column to user table")
                     except Exception as e:
                         print(f"Error adding service_type column: {e}")
+
+            if 'service_request' in inspector.get_table_names():
+                cols = [c['name'] for c in inspector.get_columns('service_request')]
+
+                if 'idempotency_key' not in cols:
+                    try:
+                        with db.engine.connect() as conn:
+                            conn.execute(text("ALTER TABLE service_request ADD COLUMN idempotency_key VARCHAR(100)"))
+                            conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_service_request_idempotency_key ON service_request (idempotency_key)"))
+                            conn.commit()
+                        print("Added 'idempotency_key' column to service_request table")
+                    except Exception as e:
+                        print(f"Error adding idempotency_key column: {e}")
                         
         except Exception as e:
             print(f'Could not ensure columns: {e}')
@@ -1,5 +1,21 @@
 import os
 
+# Rate limiting / load shedding settings read by app.py:
+#   TRUST_PROXY=1             use X-Forwarded-For for client IPs (on by default
+#                             when RENDER is set); without it behind a proxy every
+#                             visitor shares one login/register rate-limit bucket
+#   RATELIMIT_STORAGE_URL     memory:// (per worker) or sqlite:///path (shared by
+#                             all workers); defaults to instance/ratelimit.db
+#                             here since gunicorn runs several workers
+#   RATELIMIT_ENABLED=0       turn rate limiting off
+#   SHED_ENABLED=0            turn load shedding off
+#   SHED_MAX_QUEUE_WAIT       seconds a request may wait at the proxy before 503
+
+os.environ.setdefault(
+    "RATELIMIT_STORAGE_URL",
+    "sqlite:///" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "ratelimit.db"),
+)
+
 port = int(os.environ.get("PORT", 10000))
 bind = f"0.0.0.0:{port}"
 workers = 2
@@ -0,0 +1,213 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request, session
+
+
+class MemoryBackend:
+    """Token buckets kept in this process only (one set per gunicorn worker).
+
+    At most ``max_keys`` buckets are kept; beyond that the least recently used
+    bucket is dropped, which only ever resets that client to a full bucket.
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, _retry_after(tokens, rate)
+
+
+class SQLiteBackend:
+    """Token buckets in a SQLite file so every worker on the host shares them.
+
+    Each row records when its own bucket will be full again (``expires``), so
+    pruning never drops a bucket of a slower limit before it has refilled.
+    Lock waits are capped at ``timeout`` seconds so a contended file can't tie
+    up a sync worker; the limiter lets the request through instead.
+    """
+
+    def __init__(self, path, prune_every=1000, timeout=0.2):
+        self.path = path
+        self.prune_every = prune_every
+        self.timeout = timeout
+        self._local = threading.local()
+        self._calls = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        cols = [row[1] for row in conn.execute('PRAGMA table_info(rate_limit_bucket)')]
+        if cols and 'expires' not in cols:
+            # Bucket state is disposable, so an old layout is simply recreated
+            conn.execute('DROP TABLE rate_limit_bucket')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limit_bucket ('
+            'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, expires REAL NOT NULL)'
+        )
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS ix_rate_limit_bucket_expires ON rate_limit_bucket (expires)'
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, capacity, rate, now=None):
+        now = time.time() if now is None else now
+        conn = self._connect()
+        # BEGIN IMMEDIATE takes the write lock up front so the read-modify-write
+        # below cannot interleave with another worker's
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT tokens, updated FROM rate_limit_bucket WHERE key = ?', (key,)
+            ).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            expires = now + (capacity - tokens) / rate
+            conn.execute(
+                'INSERT OR REPLACE INTO rate_limit_bucket (key, tokens, updated, expires) VALUES (?, ?, ?, ?)',
+                (key, tokens, now, expires),
+            )
+            self._calls += 1
+            if self._calls % self.prune_every == 0:
+                conn.execute('DELETE FROM rate_limit_bucket WHERE expires <= ?', (now,))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return allowed, _retry_after(tokens, rate)
+
+
+def _retry_after(tokens, rate):
+    if tokens >= 1:
+        return 0
+    return max(1, int((1 - tokens) / rate + 0.999))
+
+
+def make_backend(storage_url):
+    if not storage_url or storage_url == 'memory://':
+        return MemoryBackend()
+    if storage_url.startswith('sqlite:///'):
+        return SQLiteBackend(storage_url[len('sqlite:///'):])
+    raise ValueError(f'Unsupported RATELIMIT_STORAGE_URL: {storage_url}')
+
+
+class LoadShedder:
+    """Answers 503 straight away for requests that sat in the front proxy's
+    queue (per its X-Request-Start header) longer than ``SHED_MAX_QUEUE_WAIT``
+    seconds; by then the client has usually given up anyway."""
+
+    def __init__(self, app=None):
+        self.max_queue_wait = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SHED_ENABLED', True)
+        app.config.setdefault('SHED_MAX_QUEUE_WAIT', 10.0)
+        self.max_queue_wait = app.config['SHED_MAX_QUEUE_WAIT']
+        if app.config['SHED_ENABLED'] and self.max_queue_wait:
+            app.before_request(self._check)
+
+    def _check(self):
+        wait = queue_wait(request.headers.get('X-Request-Start'))
+        if wait is not None and wait > self.max_queue_wait:
+            return _reject(503, 'Server is busy, please try again shortly.', 1)
+
+
+def queue_wait(header, now=None):
+    """Seconds spent queued according to an X-Request-Start header, if any."""
+    if not header:
+        return None
+    now = time.time() if now is None else now
+    value = header[2:] if header.startswith('t=') else header
+    try:
+        started = float(value)
+    except ValueError:
+        return None
+    # Proxies send seconds, milliseconds or microseconds since the epoch
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    return max(0.0, now - started)
+
+
+class RateLimiter:
+    def __init__(self, app=None):
+        self.backend = None
+        self.enabled = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_STORAGE_URL', 'memory://')
+        self.enabled = app.config['RATELIMIT_ENABLED']
+        self.backend = make_backend(app.config['RATELIMIT_STORAGE_URL'])
+
+    def limit(self, scope, capacity, per_seconds, key='ip', methods=('POST',), exempt_when=None):
+        """Allow ``capacity`` requests per ``per_seconds`` for each client key.
+
+        ``key`` is ``'ip'`` or ``'user'``; ``'user'`` falls back to the IP for
+        anonymous visitors. Only requests whose method is in ``methods`` are
+        counted, so GETs of the login/register pages are never limited.
+        A request that would be rejected is still served, without using a
+        token, when ``exempt_when()`` returns true; it is only consulted after
+        the bucket is empty so the common path does no extra work. If the
+        backend fails (e.g. the SQLite file is locked) the request is served.
+        """
+        rate = capacity / per_seconds
+
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                if not self.enabled or request.method not in methods:
+                    return view(*args, **kwargs)
+
+                try:
+                    allowed, retry_after = self.backend.take(f'{scope}:{_client_key(key)}', capacity, rate)
+                except sqlite3.Error as e:
+                    current_app.logger.warning(f'Rate limiter unavailable, allowing request: {e}')
+                    return view(*args, **kwargs)
+                if not allowed and not (exempt_when is not None and exempt_when()):
+                    return _reject(429, 'Too many requests, please slow down.', retry_after)
+                return view(*args, **kwargs)
+            return wrapped
+        return decorator
+
+
+def _client_key(key):
+    if key == 'user' and session.get('user_id'):
+        return f"user:{session['user_id']}"
+    return f'ip:{request.remote_addr}'
+
+
+def _reject(status, message, retry_after):
+    return message, status, {'Retry-After': str(retry_after), 'Content-Type': 'text/plain; charset=utf-8'}
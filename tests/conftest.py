@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    # app.py sets up its database and logs/ on import, so keep both out of the repo.
+    # The environment only matters during the import and is restored afterwards.
+    workdir = tmp_path_factory.mktemp('app')
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('DATABASE_URL', f"sqlite:///{workdir / 'test.db'}")
+        mp.setenv('RATELIMIT_STORAGE_URL', 'memory://')
+        mp.chdir(workdir)
+        import app
+    app.app.config['TESTING'] = True
+    return app
@@ -0,0 +1,112 @@
+import pytest
+
+from rate_limit import MemoryBackend
+
+
+@pytest.fixture
+def client(app_module, monkeypatch, tmp_path):
+    # The error handler appends to logs/error.log relative to the cwd
+    (tmp_path / 'logs').mkdir()
+    monkeypatch.chdir(tmp_path)
+    # confirmation.html needs provider details the view doesn't pass; only the
+    # stored request (or the error message) matters here
+    def render(name, **ctx):
+        return f"{name}:{ctx['request'].id}" if 'request' in ctx else f"{name}:{ctx.get('message')}"
+
+    monkeypatch.setattr(app_module, 'render_template', render)
+    monkeypatch.setattr(app_module.limiter, 'backend', MemoryBackend())
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    return client
+
+
+def _form(**overrides):
+    form = {
+        'service_id': 1,
+        'customer_name': 'Asha',
+        'customer_email': 'asha@example.com',
+        'customer_phone': '555-0100',
+        'address': '1 Main St',
+    }
+    form.update(overrides)
+    return form
+
+
+def _count(app_module):
+    with app_module.app.app_context():
+        return app_module.ServiceRequest.query.count()
+
+
+def test_retry_with_same_key_returns_original(app_module, client):
+    before = _count(app_module)
+    first = client.post('/submit_request', data=_form(idempotency_key='retry-1'))
+    second = client.post('/submit_request', data=_form(idempotency_key='retry-1'))
+    assert first.data == second.data
+    assert _count(app_module) == before + 1
+
+
+def test_reused_key_with_different_details_is_rejected(app_module, client):
+    first = client.post('/submit_request', data=_form(idempotency_key='edit-1', urgency='low'))
+    before = _count(app_module)
+    edited = client.post('/submit_request', data=_form(idempotency_key='edit-1', urgency='emergency'))
+    assert edited.status_code == 422
+    assert edited.data != first.data
+    assert _count(app_module) == before
+
+
+def test_long_keys_sharing_a_prefix_do_not_collide(app_module, client):
+    prefix = 'k' * 64
+    first = client.post('/submit_request', data=_form(idempotency_key=prefix + 'a'))
+    second = client.post('/submit_request', data=_form(idempotency_key=prefix + 'b'))
+    assert first.status_code == second.status_code == 200
+    assert first.data != second.data
+
+
+def test_replay_lookup_only_runs_when_rate_limited(app_module, client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, '_find_idempotent_request', lambda key: calls.append(key))
+    monkeypatch.setattr(app_module.limiter, 'backend', MemoryBackend())
+    client.post('/submit_request', data=_form(idempotency_key='peek-1'))
+    # The view itself looks the key up once; the limiter does not
+    assert len(calls) == 1
+
+
+def test_retries_do_not_use_up_rate_limit(app_module, client):
+    for i in range(10):
+        assert client.post('/submit_request', data=_form(idempotency_key=f'limit-{i}')).status_code == 200
+    assert client.post('/submit_request', data=_form(idempotency_key='limit-0')).status_code == 200
+    response = client.post('/submit_request', data=_form(idempotency_key='limit-new'))
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+
+
+def test_lost_race_returns_winning_row(app_module, client, monkeypatch):
+    winner = client.post('/submit_request', data=_form(idempotency_key='race-1'))
+    before = _count(app_module)
+    real_find = app_module._find_idempotent_request
+    calls = []
+
+    def find_after_race(key):
+        # Pretend the other request commits right after our existence checks
+        calls.append(key)
+        return None if len(calls) <= 1 else real_find(key)
+
+    monkeypatch.setattr(app_module, '_find_idempotent_request', find_after_race)
+    loser = client.post('/submit_request', data=_form(idempotency_key='race-1'))
+    assert loser.data == winner.data
+    assert _count(app_module) == before
+
+
+def test_integrity_error_without_matching_key_is_raised(app_module, client):
+    before = _count(app_module)
+    response = client.post('/submit_request', data=_form(customer_name=None, idempotency_key='bad-1'))
+    assert response.status_code == 500
+    assert b'NOT NULL constraint failed' in response.data
+    assert _count(app_module) == before
+
+
+def test_load_shedding_rejects_long_queued_requests(app_module, client):
+    response = client.get('/get_services', headers={'X-Request-Start': 't=1000000000'})
+    assert response.status_code == 503
+    assert client.get('/get_services').status_code == 200
@@ -0,0 +1,158 @@
+import sqlite3
+import threading
+
+import pytest
+from flask import Flask
+
+from rate_limit import MemoryBackend, RateLimiter, SQLiteBackend, queue_wait
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / 'rl.db'), prune_every=2)
+
+
+def test_bucket_drains_and_refills(backend):
+    for _ in range(5):
+        assert backend.take('k', 5, 5 / 3600, now=1000)[0]
+    allowed, retry_after = backend.take('k', 5, 5 / 3600, now=1000)
+    assert not allowed
+    assert retry_after == 720
+    assert backend.take('k', 5, 5 / 3600, now=1000 + 720)[0]
+    assert not backend.take('k', 5, 5 / 3600, now=1000 + 720)[0]
+
+
+def test_keys_are_independent(backend):
+    assert backend.take('a', 1, 1, now=0)[0]
+    assert not backend.take('a', 1, 1, now=0)[0]
+    assert backend.take('b', 1, 1, now=0)[0]
+
+
+def test_pruning_keeps_slower_scopes(backend):
+    for _ in range(5):
+        backend.take('register:ip:1', 5, 5 / 3600, now=0)
+    # Fast-refilling scope traffic well after its own window, enough to prune
+    for i in range(4):
+        backend.take(f'submit:user:{i}', 10, 10 / 60, now=61)
+    assert not backend.take('register:ip:1', 5, 5 / 3600, now=61)[0]
+
+
+def test_memory_backend_caps_keys():
+    backend = MemoryBackend(max_keys=3)
+    for i in range(10):
+        backend.take(f'k{i}', 1, 1 / 3600, now=0)
+    assert len(backend._buckets) == 3
+    assert list(backend._buckets) == ['k7', 'k8', 'k9']
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_keys=2)
+    backend.take('a', 2, 1 / 3600, now=0)
+    backend.take('b', 2, 1 / 3600, now=0)
+    backend.take('a', 2, 1 / 3600, now=1)
+    backend.take('c', 2, 1 / 3600, now=2)
+    assert list(backend._buckets) == ['a', 'c']
+
+
+def test_sqlite_backend_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'rl.db')
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+    assert first.take('k', 2, 1 / 3600, now=0)[0]
+    assert second.take('k', 2, 1 / 3600, now=0)[0]
+    assert not first.take('k', 2, 1 / 3600, now=0)[0]
+
+
+def test_sqlite_backend_concurrent_takes_never_overdraw(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'rl.db'))
+    results = []
+
+    def worker():
+        for _ in range(10):
+            results.append(backend.take('k', 25, 1 / 3600, now=0)[0])
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results.count(True) == 25
+
+
+def test_sqlite_backend_times_out_quickly_when_locked(tmp_path):
+    path = str(tmp_path / 'rl.db')
+    backend = SQLiteBackend(path, timeout=0.05)
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute('BEGIN IMMEDIATE')
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            backend.take('k', 1, 1, now=0)
+    finally:
+        holder.execute('ROLLBACK')
+    # The failed attempt left no transaction open behind it
+    assert backend.take('k', 1, 1, now=0)[0]
+
+
+def _limited_app(backend, exempt_when=None):
+    app = Flask(__name__)
+    limiter = RateLimiter(app)
+    limiter.backend = backend
+
+    @app.route('/', methods=['POST'])
+    @limiter.limit('test', 1, 3600, exempt_when=exempt_when)
+    def view():
+        return 'ok'
+
+    return app
+
+
+def test_limiter_fails_open_when_backend_is_locked(tmp_path):
+    path = str(tmp_path / 'rl.db')
+    client = _limited_app(SQLiteBackend(path, timeout=0.05)).test_client()
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute('BEGIN IMMEDIATE')
+    try:
+        assert client.post('/').status_code == 200
+        assert client.post('/').status_code == 200
+    finally:
+        holder.execute('ROLLBACK')
+
+
+def test_limiter_rejects_with_retry_after():
+    client = _limited_app(MemoryBackend()).test_client()
+    assert client.post('/').status_code == 200
+    response = client.post('/')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 3500
+    assert client.get('/').status_code == 405
+
+
+def test_exempt_when_only_consulted_after_rejection():
+    calls = []
+
+    def exempt():
+        calls.append(True)
+        return True
+
+    client = _limited_app(MemoryBackend(), exempt_when=exempt).test_client()
+    assert client.post('/').status_code == 200
+    assert calls == []
+    assert client.post('/').status_code == 200
+    assert calls == [True]
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('t=1000000000.5', 2.5),
+    ('1000000000.5', 2.5),
+    ('t=1000000000500', 2.5),
+    ('t=1000000000500000', 2.5),
+])
+def test_queue_wait_units(header, expected):
+    assert queue_wait(header, now=1000000003) == pytest.approx(expected)
+
+
+def test_queue_wait_ignores_missing_or_bad_header():
+    assert queue_wait(None, now=0) is None
+    assert queue_wait('t=soon', now=0) is None
+    assert queue_wait('t=2000000000', now=1000000000) == 0.0